@@ -1,9 +1,18 @@
-import json
+import asyncio
+import orjson
 import urllib.parse
 from typing import List, AsyncIterable
 from urllib.parse import urlparse, urljoin, quote
 
 from plugins.client import MangaClient, MangaCard, MangaChapter
+from tools import TTLCache
+
+# Chapter list API responses, keyed by request url
+_chapters_cache = TTLCache(maxsize=1000, ttl=600)
+
+# Chapter list pages requested concurrently by iter_chapters
+_PAGE_WINDOW = 8
+
 
 class AtsumaruClient(MangaClient):
     base_url = "https://atsu.moe"
@@ -16,6 +25,25 @@ class AtsumaruClient(MangaClient):
     def __init__(self, *args, name="Atsumaru", **kwargs):
         super().__init__(*args, name=name, headers=self.api_headers, **kwargs)
 
+    def _chapters_url(self, slug: str, page: int) -> str:
+        return f"{self.base_url}/api/manga/chapters?id={slug}&filter=all&sort=desc&page={page}"
+
+    async def _cached_get(self, url: str, ttl: int = 600) -> bytes:
+        content = _chapters_cache.get(url)
+        if content is None:
+            response = await self.get_url(url, req_content=False)
+            content = response.content
+            # Only keep successful responses, errors are retried on the next call
+            if str(response.status_code).startswith('2'):
+                _chapters_cache.set(url, content, ttl)
+        return content
+
+    def _invalidate_chapters(self, slug: str, keep=()):
+        prefix = f"{self.base_url}/api/manga/chapters?id={slug}&"
+        for url in _chapters_cache:
+            if url.startswith(prefix) and url not in keep:
+                _chapters_cache.pop(url)
+
     async def search(self, query: str = "", page: int = 1) -> List[MangaCard]:
         # Handle "Latest Updates" or "Popular" if query is empty
         if not query:
@@ -25,9 +53,9 @@ class AtsumaruClient(MangaClient):
             url = f"{self.base_url}/api/infinite/trending?page={api_page}&types=Manga,Manwha,Manhua,OEL"
             content = await self.get_url(url)
             try:
-                data = json.loads(content)
+                data = orjson.loads(content)
                 items = data.get("items", [])
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 return []
         else:
             # Using search endpoint
@@ -45,33 +73,33 @@ class AtsumaruClient(MangaClient):
             
             content = await self.get_url(url)
             try:
-                data = json.loads(content)
+                data = orjson.loads(content)
                 # Search returns 'hits', each hit has a 'document'
                 items = [hit['document'] for hit in data.get("hits", [])]
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 return []
 
+        static_prefix = f"{self.base_url}/static/"
+        manga_prefix = f"{self.base_url}/manga/"
+
         mangas = []
+        append = mangas.append
         for item in items:
-            manga_id = item.get("id")
-            title = item.get("title")
+            get = item.get
             
             # Image handling based on DTO logic
-            image_path = item.get("poster") or item.get("image")
+            image_path = get("poster") or get("image")
             if isinstance(image_path, dict):
                  image_path = image_path.get("image")
             
             if image_path:
                 # Remove prefixes if present (Kotlin logic)
-                image_path = str(image_path).removeprefix("/").removeprefix("static/")
-                thumbnail_url = f"{self.base_url}/static/{image_path}"
+                thumbnail_url = static_prefix + str(image_path).removeprefix("/").removeprefix("static/")
             else:
                 thumbnail_url = ""
 
             # Store full URL for convenience
-            manga_url = f"{self.base_url}/manga/{manga_id}"
-            
-            mangas.append(MangaCard(self, title, manga_url, thumbnail_url))
+            append(MangaCard(self, get("title"), manga_prefix + str(get("id")), thumbnail_url))
 
         return mangas
 
@@ -83,75 +111,81 @@ class AtsumaruClient(MangaClient):
         # API expects page starting at 0, bot uses 1. 
         api_page = page - 1
         
-        url = f"{self.base_url}/api/manga/chapters?id={slug}&filter=all&sort=desc&page={api_page}"
-        content = await self.get_url(url)
+        url = self._chapters_url(slug, api_page)
+        content = await self._cached_get(url)
         
         try:
-            data = json.loads(content)
+            data = orjson.loads(content)
             chapters_data = data.get("chapters", [])
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             return []
 
+        # Construct a unique URL for the chapter: https://atsu.moe/read/{slug}/{chapter_id}
+        read_prefix = f"{self.base_url}/read/{slug}/"
+
         chapters = []
+        append = chapters.append
         for ch in chapters_data:
-            ch_id = ch.get("id")
-            title = ch.get("title")
-            number = ch.get("number", "")
-            
-            # Construct a unique URL for the chapter: https://atsu.moe/read/{slug}/{chapter_id}
-            chapter_url = f"{self.base_url}/read/{slug}/{ch_id}"
+            get = ch.get
+            title = get("title")
+            number = get("number", "")
             
             # Clean up title
-            display_title = f"{title}"
-            if number:
-                display_title = f"Ch. {number} - {title}"
+            display_title = f"Ch. {number} - {title}" if number else str(title)
 
-            chapters.append(MangaChapter(self, display_title, chapter_url, manga_card, []))
+            append(MangaChapter(self, display_title, read_prefix + str(get("id")), manga_card, []))
 
         return chapters
 
     async def iter_chapters(self, manga_url: str, manga_name) -> AsyncIterable[MangaChapter]:
         manga_card = MangaCard(self, manga_name, manga_url, '')
         slug = manga_url.split("/")[-1]
+        read_prefix = f"{self.base_url}/read/{slug}/"
         
         page = 0
-        while True:
-            url = f"{self.base_url}/api/manga/chapters?id={slug}&filter=all&sort=desc&page={page}"
-            content = await self.get_url(url)
-            try:
-                data = json.loads(content)
-                chapters_data = data.get("chapters", [])
-                
+        total_pages = 1  # Known once the first page is fetched
+        while page < total_pages:
+            # The first page alone, then windows of pages fetched concurrently.
+            # Later windows are only requested if the caller keeps iterating.
+            pages = range(page, min(page + (_PAGE_WINDOW if page else 1), total_pages))
+            contents = await asyncio.gather(*(self._cached_get(self._chapters_url(slug, p)) for p in pages))
+
+            for content in contents:
+                try:
+                    data = orjson.loads(content)
+                    chapters_data = data.get("chapters", [])
+                except Exception:
+                    return
+
                 if not chapters_data:
-                    break
-                    
+                    return
+
                 for ch in chapters_data:
-                    ch_id = ch.get("id")
-                    title = ch.get("title")
-                    number = ch.get("number", "")
-                    chapter_url = f"{self.base_url}/read/{slug}/{ch_id}"
-                    
-                    display_title = f"{title}"
-                    if number:
-                        display_title = f"Ch. {number} - {title}"
+                    get = ch.get
+                    title = get("title")
+                    number = get("number", "")
+                    display_title = f"Ch. {number} - {title}" if number else str(title)
                         
-                    yield MangaChapter(self, display_title, chapter_url, manga_card, [])
+                    yield MangaChapter(self, display_title, read_prefix + str(get("id")), manga_card, [])
+
+                if page == 0:
+                    # Check pagination from DTO: hasNextPage logic (page + 1 < pages)
+                    total_pages = data.get("pages", 0)
 
-                # Check pagination from DTO: hasNextPage logic (page + 1 < pages)
-                total_pages = data.get("pages", 0)
-                if page + 1 >= total_pages:
-                    break
-                page += 1
-                
-            except Exception:
-                break
+            page = pages.stop
+
+    async def set_pictures(self, manga_chapter: MangaChapter):
+        # The reader page is never used, its url already names the chapter,
+        # so go straight to the API instead of fetching the page first
+        manga_chapter.pictures = await self._pictures_from_url(manga_chapter.url)
+        return manga_chapter
 
     async def pictures_from_chapters(self, content: bytes, response=None):
         if response:
-            url_str = str(response.url)
-        else:
-            return []
+            return await self._pictures_from_url(str(response.url))
+        return []
 
+    async def _pictures_from_url(self, url_str: str):
         try:
             parts = url_str.split("/")
             # URL format: https://atsu.moe/read/{slug}/{chapter_id}
@@ -163,7 +197,7 @@ class AtsumaruClient(MangaClient):
             
             # We need to make a new request to the API
             json_content = await self.get_url(api_url)
-            data = json.loads(json_content)
+            data = orjson.loads(json_content)
             
             # Parse logic from Kotlin: response.readChapter.pages.image
             pages = data.get("readChapter", {}).get("pages", [])
@@ -182,30 +216,25 @@ class AtsumaruClient(MangaClient):
     async def contains_url(self, url: str):
         return url.startswith("https://atsu.moe/")
 
+    async def _check_one(self, lc) -> bool:
+        # Extract ID from saved URL: https://atsu.moe/manga/{id}
+        slug = lc.url.split("/")[-1]
+        url = self._chapters_url(slug, 0)
+
+        # Always ask the API for the newest page, iter_chapters then reads it from the cache
+        _chapters_cache.pop(url)
+        content = await self._cached_get(url)
+        chapters_data = orjson.loads(content).get("chapters", [])
+        if not chapters_data:
+            return False
+
+        if f"{self.base_url}/read/{slug}/{chapters_data[0].get('id')}" == lc.chapter_url:
+            return False
+
+        # New chapters shift every later page
+        self._invalidate_chapters(slug, keep=(url,))
+        return True
+
     async def check_updated_urls(self, last_chapters):
-        # We check the recentlyUpdated API endpoint
-        url = f"{self.base_url}/api/infinite/recentlyUpdated?page=0&types=Manga,Manwha,Manhua,OEL"
-        content = await self.get_url(url)
-        try:
-            data = json.loads(content)
-            items = data.get("items", [])
-            
-            # Map of MangaID -> True
-            updated_ids = {item.get("id"): True for item in items}
-            
-            updated = []
-            not_updated = []
-            
-            for lc in last_chapters:
-                # Extract ID from saved URL: https://atsu.moe/manga/{id}
-                manga_id = lc.url.split("/")[-1]
-                
-                if manga_id in updated_ids:
-                    updated.append(lc.url)
-                else:
-                    not_updated.append(lc.url)
-            
-            return updated, not_updated
-            
-        except Exception:
-            return [], [lc.url for lc in last_chapters]
\ No newline at end of file
+        # Compare the newest chapter of every manga with the last one we sent
+        return await self.check_updated_each(last_chapters, self._check_one)
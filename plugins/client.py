@@ -1,13 +1,19 @@
+import asyncio
 import os
 from abc import abstractmethod, ABC
 from dataclasses import dataclass
-from typing import List, AsyncIterable
+from typing import List, AsyncIterable, Awaitable, Callable
 
-from httpx import AsyncClient
+from httpx import AsyncClient, Limits
+from loguru import logger
 from pathlib import Path
 
 from models import LastChapter
-from tools import LanguageSingleton
+from tools import LanguageSingleton, TTLCache
+
+# Each client is a long lived singleton talking to a single site, keep its pooled
+# connections alive between user actions instead of httpx's 5 seconds default
+POOL_LIMITS = Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
 
 
 @dataclass
@@ -54,8 +60,10 @@ class MangaClient(AsyncClient, metaclass=LanguageSingleton):
     def __init__(self, *args, name="client", **kwargs):
         if name == "client":
             raise NotImplementedError
+        kwargs.setdefault('limits', POOL_LIMITS)
         super().__init__(*args, **kwargs)
         self.name = name
+        self._search_cache = TTLCache(maxsize=256, ttl=60)
 
     async def get_url(self, url, *args, file_name=None, cache=False, req_content=True, method='get', data=None,
                       **kwargs):
@@ -138,6 +146,41 @@ class MangaClient(AsyncClient, metaclass=LanguageSingleton):
     async def check_updated_urls(self, last_chapters: List[LastChapter]):
         return [lc.url for lc in last_chapters], []
 
+    async def check_updated_each(self, last_chapters: List[LastChapter],
+                                 check_one: Callable[[LastChapter], Awaitable[bool]], limit: int = 10):
+        # Runs check_one for every last chapter concurrently, at most `limit` at a time.
+        # A check that raises counts as updated, so iter_chapters gets to decide.
+        semaphore = asyncio.Semaphore(limit)
+
+        async def bounded(lc: LastChapter):
+            async with semaphore:
+                return await check_one(lc)
+
+        results = await asyncio.gather(*(bounded(lc) for lc in last_chapters), return_exceptions=True)
+
+        updated = []
+        not_updated = []
+        for lc, result in zip(last_chapters, results):
+            if isinstance(result, BaseException):
+                logger.opt(exception=result).warning(
+                    f"Error while checking updates for url {lc.url} on site: {self.name}, err: {result}")
+            if result is False:
+                not_updated.append(lc.url)
+            else:
+                updated.append(lc.url)
+        return updated, not_updated
+
+    async def search_cached(self, url: str, parse: Callable[[bytes], List[MangaCard]]) -> List[MangaCard]:
+        # The bot often runs the same query twice within seconds: once from "All" and once
+        # from the plugin button, or when the same button is clicked again. Parsed results
+        # are kept for a minute. Empty results are not kept, the site may have refused us.
+        mangas = self._search_cache.get(url)
+        if mangas is None:
+            mangas = parse(await self.get_url(url))
+            if mangas:
+                self._search_cache.set(url, mangas)
+        return list(mangas)
+
     @abstractmethod
     async def search(self, query: str = "", page: int = 1) -> List[MangaCard]:
         raise NotImplementedError
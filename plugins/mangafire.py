@@ -1,14 +1,32 @@
+import os
 import re
-import json
+import orjson
 import asyncio
 from io import BytesIO
-from typing import List, AsyncIterable
-from urllib.parse import urlparse, urljoin, quote
+from typing import List, AsyncIterable, Optional
+from urllib.parse import urljoin, quote
 
-from PIL import Image as PILImage
-from bs4 import BeautifulSoup
+import numpy as np
+from loguru import logger
+from PIL import Image as PILImage, features as PILFeatures
+from selectolax.lexbor import LexborHTMLParser
 
 from plugins.client import MangaClient, MangaCard, MangaChapter
+from tools import TTLCache
+
+# Descrambling decodes and re-encodes every page as JPEG, which relies on the SIMD
+# codec of libjpeg-turbo (bundled with Pillow wheels, missing from some source builds)
+if not PILFeatures.check_feature("libjpeg_turbo"):
+    logger.warning("MangaFire: Pillow is built without libjpeg-turbo, image descrambling will be slow")
+
+# Manga id is the part after the last dot: https://mangafire.to/manga/title.id
+_MANGA_ID_RE = re.compile(r"/manga/[^/?#]*\.([^./?#]+)")
+
+
+def _manga_id(url: str) -> Optional[str]:
+    match = _MANGA_ID_RE.search(url)
+    return match.group(1) if match else None
+
 
 class MangaFireClient(MangaClient):
     base_url = "https://mangafire.to"
@@ -22,6 +40,10 @@ class MangaFireClient(MangaClient):
 
     def __init__(self, *args, name="MangaFire", **kwargs):
         super().__init__(*args, name=name, headers=self.pre_headers, **kwargs)
+        # Bounds how many images are descrambled in worker threads at once
+        self._descramble_semaphore = asyncio.Semaphore(os.cpu_count() or 1)
+        # Parsed chapter lists (url, number, title), keyed by manga id
+        self._chapter_cache = TTLCache(maxsize=1000, ttl=600)
 
     def _descramble_image(self, image_data: bytes, offset: int) -> bytes:
         """
@@ -45,38 +67,33 @@ class MangaFireClient(MangaClient):
                 x_max = ceil_div(width, piece_width) - 1
                 y_max = ceil_div(height, piece_height) - 1
                 
-                # Create new blank image
-                result = PILImage.new("RGBA", (width, height))
+                # Work on raw pixel buffers, tiles are moved with slice copies.
+                # Scrambled pages are JPEGs, so they are usually RGB already and
+                # need no conversion copy; the output is written as RGB directly.
+                src = np.asarray(img if img.mode == "RGB" else img.convert("RGB"))
+                dst = np.empty_like(src)
+                
+                # Source tile index for every destination column / row.
+                # The last column and row are never shuffled.
+                x_src_idx = np.arange(x_max + 1)
+                x_src_idx[:-1] = (x_max - x_src_idx[:-1] + offset) % x_max if x_max else 0
+                y_src_idx = np.arange(y_max + 1)
+                y_src_idx[:-1] = (y_max - y_src_idx[:-1] + offset) % y_max if y_max else 0
                 
                 for y in range(y_max + 1):
+                    y_dst = piece_height * y
+                    h = min(piece_height, height - y_dst)
+                    y_src = piece_height * int(y_src_idx[y])
+                    
                     for x in range(x_max + 1):
                         x_dst = piece_width * x
-                        y_dst = piece_height * y
-                        
                         w = min(piece_width, width - x_dst)
-                        h = min(piece_height, height - y_dst)
-                        
-                        # Calculate Source X
-                        if x == x_max:
-                            x_src_idx = x
-                        else:
-                            x_src_idx = (x_max - x + offset) % x_max
-                        x_src = piece_width * x_src_idx
-
-                        # Calculate Source Y
-                        if y == y_max:
-                            y_src_idx = y
-                        else:
-                            y_src_idx = (y_max - y + offset) % y_max
-                        y_src = piece_height * y_src_idx
+                        x_src = piece_width * int(x_src_idx[x])
                         
-                        # Crop and Paste
-                        box = (x_src, y_src, x_src + w, y_src + h)
-                        piece = img.crop(box)
-                        result.paste(piece, (x_dst, y_dst))
+                        dst[y_dst:y_dst + h, x_dst:x_dst + w] = src[y_src:y_src + h, x_src:x_src + w]
                 
                 output = BytesIO()
-                result.convert("RGB").save(output, format="JPEG", quality=90)
+                PILImage.fromarray(dst).save(output, format="JPEG", quality=90)
                 return output.getvalue()
         except Exception as e:
             print(f"Descramble error: {e}")
@@ -106,7 +123,9 @@ class MangaFireClient(MangaClient):
         content = await super().get_url(url, *args, **kwargs)
         
         if is_scrambled and isinstance(content, bytes):
-            return self._descramble_image(content, offset)
+            # Descrambling is CPU bound, keep it off the event loop
+            async with self._descramble_semaphore:
+                return await asyncio.to_thread(self._descramble_image, content, offset)
             
         return content
 
@@ -122,41 +141,38 @@ class MangaFireClient(MangaClient):
         
         url = f"{self.base_url}/filter?keyword={std_query}&page={page}"
         
-        content = await self.get_url(url)
-        bs = BeautifulSoup(content, "html.parser")
+        return await self.search_cached(url, self.mangas_from_page)
+
+    def mangas_from_page(self, page: bytes):
+        tree = LexborHTMLParser(page)
         
         # Selector: .original.card-lg .unit .inner
-        container = bs.select(".original.card-lg .unit .inner")
+        container = tree.css(".original.card-lg .unit .inner")
         
         mangas = []
         for element in container:
-            info_link = element.select_one(".info > a")
+            info_link = element.css_first(".info > a")
             if not info_link:
                 continue
                 
-            name = info_link.text.strip()
+            name = info_link.text().strip()
             # href is usually /manga/slug.id
-            manga_url = urljoin(self.base_url, info_link["href"])
+            manga_url = urljoin(self.base_url, info_link.attributes["href"])
             
-            img = element.select_one("img")
-            picture_url = img["src"] if img else ""
+            img = element.css_first("img")
+            picture_url = img.attributes["src"] if img else ""
             
             mangas.append(MangaCard(self, name, manga_url, picture_url))
             
         return mangas
 
-    async def get_chapters(self, manga_card: MangaCard, page: int = 1) -> List[MangaChapter]:
-        # MangaFire loads chapters via AJAX.
-        # URL: /ajax/manga/{id}/chapter/{lang}
-        # We need to extract the ID from the URL.
-        # URL format: https://mangafire.to/manga/title.id  (ID is the part after the last dot)
+    async def _chapter_entries(self, manga_id: str) -> List[tuple]:
+        # The chapter list is fetched and parsed once per manga, then served
+        # from the cache for every page of get_chapters and for iter_chapters.
+        entries = self._chapter_cache.get(manga_id)
+        if entries is not None:
+            return entries
         
-        try:
-            path = urlparse(manga_card.url).path # /manga/title.id
-            manga_id = path.split(".")[-1]
-        except:
-            return []
-            
         # 0 = English (usually), but the site uses codes like 'en', 'es'. 
         # The bot seems to pass specific language clients. 
         # For now, we default to 'en'.
@@ -166,31 +182,56 @@ class MangaFireClient(MangaClient):
         
         content = await self.get_url(ajax_url)
         
-        try:
-            data = json.loads(content)
-            if data.get("status") != 200:
-                return []
+        data = orjson.loads(content)
+        if data.get("status") != 200:
+            return []
+        
+        html_content = data.get("result", "")
+        tree = LexborHTMLParser(html_content)
+        
+        # Selector from Kotlin: .vol-list > .item OR li
+        # Usually it returns a list of <li> elements
+        items = tree.css("li.item")
+        
+        base_url = self.base_url
+        entries = []
+        append = entries.append
+        for item in items:
+            link = item.css_first("a")
+            if not link:
+                continue
+                
+            # Chapter hrefs are site absolute paths, skip urljoin for those
+            href = link.attributes["href"]
+            url = base_url + href if href.startswith("/") else urljoin(base_url, href)
             
-            html_content = data.get("result", "")
-            bs = BeautifulSoup(html_content, "html.parser")
+            # Title parsing
+            number = item.attributes.get("data-number", "")
+            title_span = item.css_first("span")
+            raw_title = title_span.text().strip() if title_span else ""
             
-            # Selector from Kotlin: .vol-list > .item OR li
-            # Usually it returns a list of <li> elements
-            items = bs.select("li.item")
+            append((url, number, raw_title))
+        
+        self._chapter_cache.set(manga_id, entries)
+        return entries
+
+    async def get_chapters(self, manga_card: MangaCard, page: int = 1) -> List[MangaChapter]:
+        # MangaFire loads chapters via AJAX.
+        # URL: /ajax/manga/{id}/chapter/{lang}
+        # We need to extract the ID from the URL.
+        # URL format: https://mangafire.to/manga/title.id  (ID is the part after the last dot)
+        
+        manga_id = _manga_id(manga_card.url)
+        if not manga_id:
+            return []
+            
+        try:
+            # MangaFire returns ALL chapters in one list usually. 
+            # We simulate pagination for the bot, only the requested page is built.
+            entries = (await self._chapter_entries(manga_id))[(page - 1) * 20 : page * 20]
             
             chapters = []
-            for item in items:
-                link = item.select_one("a")
-                if not link:
-                    continue
-                    
-                url = urljoin(self.base_url, link["href"])
-                
-                # Title parsing
-                number = item.get("data-number", "")
-                title_span = item.select_one("span")
-                raw_title = title_span.text.strip() if title_span else ""
-                
+            for url, number, raw_title in entries:
                 name = raw_title
                 if number:
                     name = f"Chapter {number}: {raw_title}"
@@ -201,9 +242,7 @@ class MangaFireClient(MangaClient):
                 
                 chapters.append(MangaChapter(self, name, url, manga_card, []))
                 
-            # MangaFire returns ALL chapters in one list usually. 
-            # We simulate pagination for the bot.
-            return chapters[(page - 1) * 20 : page * 20]
+            return chapters
             
         except Exception as e:
             print(f"MangaFire chapter error: {e}")
@@ -214,24 +253,11 @@ class MangaFireClient(MangaClient):
         
         # Similar logic to get_chapters but yields all
         try:
-            path = urlparse(manga_url).path
-            manga_id = path.split(".")[-1]
-            lang_code = "en"
-            ajax_url = f"{self.base_url}/ajax/manga/{manga_id}/chapter/{lang_code}"
+            manga_id = _manga_id(manga_url)
+            if not manga_id:
+                return
             
-            content = await self.get_url(ajax_url)
-            data = json.loads(content)
-            html_content = data.get("result", "")
-            bs = BeautifulSoup(html_content, "html.parser")
-            items = bs.select("li.item")
-            
-            for item in items:
-                link = item.select_one("a")
-                if not link: continue
-                url = urljoin(self.base_url, link["href"])
-                number = item.get("data-number", "")
-                title_span = item.select_one("span")
-                raw_title = title_span.text.strip() if title_span else ""
+            for url, number, raw_title in await self._chapter_entries(manga_id):
                 name = f"Chapter {number}" if number else raw_title
                 
                 yield MangaChapter(self, name, url, manga_card, [])
@@ -283,8 +309,6 @@ class MangaFireClient(MangaClient):
         # It is usually embedded in the HTML `data-id` or inside a JS `window.` variable.
         
         try:
-            html_str = content.decode('utf-8', errors='ignore')
-            
             # Look for a pattern like: chapter_id = 12345
             # Or data-id="12345" on a wrapper.
             # Only heuristic guessing is possible without live JS.
@@ -309,29 +333,16 @@ class MangaFireClient(MangaClient):
     async def contains_url(self, url: str):
         return "mangafire.to" in url
 
+    async def _check_one(self, lc) -> bool:
+        manga_id = _manga_id(lc.url)
+        if not manga_id:
+            return False
+
+        # Always refetch the list, iter_chapters then reads it from the cache
+        self._chapter_cache.pop(manga_id)
+        entries = await self._chapter_entries(manga_id)
+        return bool(entries) and entries[0][0] != lc.chapter_url
+
     async def check_updated_urls(self, last_chapters):
-        # Use latest updates page
-        content = await self.get_url(f"{self.base_url}/filter?sort=recently_updated")
-        bs = BeautifulSoup(content, "html.parser")
-        
-        updates = {}
-        container = bs.select(".original.card-lg .unit .inner")
-        
-        for element in container:
-            link = element.select_one(".info > a")
-            if link:
-                m_url = urljoin(self.base_url, link["href"])
-                # We need the chapter URL too? 
-                # The card usually links to the manga, not the specific latest chapter in the href.
-                # But sometimes there's a badge.
-                updates[m_url] = True 
-        
-        updated = []
-        not_updated = []
-        for lc in last_chapters:
-            if lc.url in updates:
-                updated.append(lc.url)
-            else:
-                not_updated.append(lc.url)
-                
-        return updated, not_updated
\ No newline at end of file
+        # Compare the newest chapter of every manga with the last one we sent
+        return await self.check_updated_each(last_chapters, self._check_one)
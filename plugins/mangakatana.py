@@ -1,10 +1,21 @@
 import re
-from typing import List, AsyncIterable
+from itertools import islice
+from typing import List, AsyncIterable, Iterator
 from urllib.parse import urlparse, urljoin, quote
 
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 
 from plugins.client import MangaClient, MangaCard, MangaChapter
+from tools import TTLCache
+
+# Reader page script patterns, see pictures_from_chapters.
+# Matches either the image variable name or an array definition, so one scan finds both
+# Both are bytes patterns and run on the raw page, only the urls get decoded
+# The array body excludes '[' too, so a scan from an unterminated `var x=[` stops at the
+# next opening instead of running to the end of the page and backtracking
+_SCRIPT_RE = re.compile(rb"data-src['\"],\s*(\w+)|var (\w+)=\[([^\[\]]*)\]")
+_URL_RE = re.compile(rb"'([^']*)'")
+
 
 class MangaKatanaClient(MangaClient):
     base_url = "https://mangakatana.com"
@@ -15,80 +26,78 @@ class MangaKatanaClient(MangaClient):
 
     def __init__(self, *args, name="MangaKatana", **kwargs):
         super().__init__(*args, name=name, headers=self.pre_headers, **kwargs)
+        # Manga pages fetched by _check_one for updated mangas, handed to iter_chapters
+        self._updated_pages = TTLCache(maxsize=1000, ttl=600)
 
     def mangas_from_page(self, page: bytes):
-        bs = BeautifulSoup(page, "html.parser")
+        tree = LexborHTMLParser(page)
         
         # Selector based on Kotlin: div#book_list > div.item
-        items = bs.select("div#book_list > div.item")
+        items = tree.css("div#book_list > div.item")
         
         mangas = []
         for item in items:
-            text_div = item.select_one("div.text")
+            text_div = item.css_first("div.text")
             if not text_div: continue
             
-            link = text_div.select_one("h3 > a")
+            link = text_div.css_first("h3 > a")
             if not link: continue
             
-            name = link.text.strip()
-            url = link["href"]
+            name = link.text().strip()
+            url = link.attributes["href"]
             
-            img_tag = item.select_one("img")
-            picture_url = img_tag["src"] if img_tag else ""
+            img_tag = item.css_first("img")
+            picture_url = img_tag.attributes["src"] if img_tag else ""
             
             mangas.append(MangaCard(self, name, url, picture_url))
             
         return mangas
 
-    def chapters_from_page(self, page: bytes, manga: MangaCard = None):
-        bs = BeautifulSoup(page, "html.parser")
+    def iter_chapters_from_page(self, page: bytes, manga: MangaCard = None) -> Iterator[MangaChapter]:
+        # Chapters are built lazily, callers that only need a slice stop early
+        tree = LexborHTMLParser(page)
         
         # Selector based on Kotlin: tr:has(.chapter)
         # Actually standard HTML structure is usually a table or list
-        rows = bs.select(".chapter")
+        rows = tree.css(".chapter")
         
-        chapters = []
         for row in rows:
-            link = row.select_one("a")
+            link = row.css_first("a")
             if not link: continue
             
-            url = link["href"]
-            name = link.text.strip()
+            url = link.attributes["href"]
+            name = link.text().strip()
             
-            chapters.append(MangaChapter(self, name, url, manga, []))
-            
-        return chapters
+            yield MangaChapter(self, name, url, manga, [])
 
     async def pictures_from_chapters(self, content: bytes, response=None):
         # Extract images from script tag
         # Kotlin regex: data-src['"],\s*(\w+)  -> finds variable name
         # Then: var variable_name=[ ... ]
         
-        html_str = content.decode("utf-8", errors="ignore")
-        
         # 1. Find the variable name used for images
         # The script usually looks like: ... data-src', ytaw); ...
         # So we look for "data-src" followed by a comma and a variable name
-        var_name_match = re.search(r"data-src['\"],\s*(\w+)", html_str)
-        
-        if not var_name_match:
-            return []
-            
-        var_name = var_name_match.group(1)
-        
         # 2. Find the array definition: var ytaw=['url1','url2',...]
-        # Regex: var ytaw=\[([^\[]*)\]
-        array_match = re.search(f"var {var_name}=\[([^\]]*)\]", html_str)
+        # Both are found in the same scan, whichever comes first in the page
+        var_name = None
+        arrays = {}
+        for match in _SCRIPT_RE.finditer(content):
+            if match.group(1):
+                var_name = var_name or match.group(1)
+            else:
+                arrays.setdefault(match.group(2), match.group(3))
+            if var_name in arrays:
+                break
         
-        if not array_match:
+        raw_array = arrays.get(var_name)
+        if raw_array is None:
             return []
             
         # 3. Extract URLs from the array string
         # The array string is like: 'url1','url2','url3'
-        raw_array = array_match.group(1)
-        
         # Regex to capture content inside single quotes
-        urls = re.findall(r"'([^']*)'", raw_array)
+        urls = [url.decode("utf-8", errors="ignore") for url in _URL_RE.findall(raw_array)]
         
         return urls
 
@@ -97,40 +106,33 @@ class MangaKatanaClient(MangaClient):
         query = quote(query)
         url = f"{self.base_url}/page/{page}?search={query}&search_by=book_name"
         
-        content = await self.get_url(url)
-        return self.mangas_from_page(content)
+        return await self.search_cached(url, self.mangas_from_page)
 
     async def get_chapters(self, manga_card: MangaCard, page: int = 1) -> List[MangaChapter]:
         content = await self.get_url(manga_card.url)
-        return self.chapters_from_page(content, manga_card)[(page - 1) * 20 : page * 20]
+        return list(islice(self.iter_chapters_from_page(content, manga_card), (page - 1) * 20, page * 20))
 
     async def iter_chapters(self, manga_url: str, manga_name) -> AsyncIterable[MangaChapter]:
         manga_card = MangaCard(self, manga_name, manga_url, '')
-        content = await self.get_url(manga_url)
-        for chapter in self.chapters_from_page(content, manga_card):
+        content = self._updated_pages.pop(manga_url)
+        if content is None:
+            content = await self.get_url(manga_url)
+        for chapter in self.iter_chapters_from_page(content, manga_card):
             yield chapter
 
     async def contains_url(self, url: str):
         return url.startswith(self.base_url)
 
+    async def _check_one(self, lc) -> bool:
+        content = await self.get_url(lc.url)
+        newest = next(self.iter_chapters_from_page(content), None)
+        if newest is None or newest.url == lc.chapter_url:
+            return False
+
+        # The updater calls iter_chapters next, spare it the same download
+        self._updated_pages.set(lc.url, content)
+        return True
+
     async def check_updated_urls(self, last_chapters):
-        # Use latest updates page: https://mangakatana.com/page/1
-        content = await self.get_url(f"{self.base_url}/page/1")
-        bs = BeautifulSoup(content, "html.parser")
-        
-        updated_urls = set()
-        items = bs.select("div#book_list > div.item")
-        for item in items:
-            link = item.select_one("div.text > h3 > a")
-            if link:
-                updated_urls.add(link["href"])
-        
-        updated = []
-        not_updated = []
-        for lc in last_chapters:
-            if lc.url in updated_urls:
-                updated.append(lc.url)
-            else:
-                not_updated.append(lc.url)
-                
-        return updated, not_updated
\ No newline at end of file
+        # Compare the newest chapter of every manga with the last one we sent
+        return await self.check_updated_each(last_chapters, self._check_one)
@@ -1 +1,2 @@
 from .singleton import LanguageSingleton
+from .ttl_cache import TTLCache